@@ -0,0 +1,73 @@
+"""
+Measures how the parallel task execution scales with the number of hosts, and with the EXECUTION['pool_size'] config
+value. Every host is a stand-in for a real node: the loopback addresses 127.0.0.1-127.0.0.N all reach the local SSH
+server, but Fabric treats them as separate hosts (separate processes & connections).
+
+Requirements: an SSH server running locally, which accepts your key for the current user without a password.
+
+Example usage:
+
+- `python benchmarks/execution_scaling.py                   # 10, 50, 100 and 200 hosts, all at once vs pool of 20`
+- `python benchmarks/execution_scaling.py 25,100 0,10,50    # host counts, pool sizes (0 = all at once)`
+"""
+from fabric.api import env, run, execute, parallel, hide
+from fabric.network import disconnect_all
+import os
+import subprocess
+import sys
+import threading
+import time
+
+
+@parallel
+def remote_command():
+    run('sleep 0.5 && uname -n')
+
+
+def sample_memory(samples, done):
+    """
+    Records the total RSS (in KB) of this process and all of its children, until `done` is set.
+    """
+    pid = str(os.getpid())
+    while not done.is_set():
+        output = subprocess.check_output(['ps', '-A', '-o', 'pid=,ppid=,rss='])
+        total = 0
+        for line in output.decode().splitlines():
+            proc_pid, ppid, rss = line.split()
+            if pid in [proc_pid, ppid]:
+                total += int(rss)
+        samples.append(total)
+        time.sleep(0.05)
+
+
+def benchmark(host_count, pool_size):
+    env.pool_size = pool_size
+    hosts = ['127.0.0.%d' % (i + 1) for i in range(host_count)]
+    samples = []
+    done = threading.Event()
+    sampler = threading.Thread(target=sample_memory, args=(samples, done))
+    sampler.start()
+
+    start = time.time()
+    with hide('everything'):
+        execute(remote_command, hosts=hosts)
+    duration = time.time() - start
+
+    done.set()
+    sampler.join()
+    disconnect_all()
+    return duration, max(samples) / 1024.0
+
+
+if __name__ == '__main__':
+    host_counts = [int(n) for n in (sys.argv[1] if len(sys.argv) > 1 else '10,50,100,200').split(',')]
+    pool_sizes = [int(n) for n in (sys.argv[2] if len(sys.argv) > 2 else '0,20').split(',')]
+    env.disable_known_hosts = True
+    env.abort_on_prompts = True
+
+    print('%6s  %9s  %9s  %12s  %12s' % ('hosts', 'pool size', 'total (s)', 'per host (s)', 'peak RSS (MB)'))
+    for host_count in host_counts:
+        for pool_size in pool_sizes:
+            duration, peak_rss = benchmark(host_count, pool_size)
+            print('%6d  %9s  %9.2f  %12.3f  %12.1f' % (host_count, pool_size or 'all', duration,
+                                                       duration / host_count, peak_rss))
@@ -1,26 +1,34 @@
 ### --- Fabric/Global Imports --- ###
 from __future__ import with_statement
 from fabric.api import *
+from fabric.state import env_options
 import os
 import re
 
 ### --- Local Imports & Setup/Init  --- ###
 from .core.conf import load_config
-from .core.common import display_header
-from .core import Deploy, DBSync, FileSync, Provision, Upgrade
+from .core.common import display_header, run_concurrently
+from .core import Deploy, DBSync, DBFollow, FileSync, Provision, Upgrade, Warmup
 
 
 def setup():
     load_config()
 
     ### --- Configure the `env` & show/hide the header --- ###
-    __all__ = ['deploy', 'db_sync', 'file_sync', 'provision', 'upgrade', 'sync', 'dump', 'restart', 'test']
+    __all__ = ['deploy', 'db_sync', 'db_follow', 'file_sync', 'provision', 'upgrade', 'sync', 'dump', 'restart', 'test', 'warmup']
 
     env.use_ssh_config = True
     env.local = env.conf.local
     env.dev = env.conf.dev
     env.prod = env.conf.prod
 
+    # Limits & timeouts for the `@parallel` tasks (see EXECUTION in config_example.py). The command line options have
+    # already been applied to `env` by now, so a value only gets set if the option was left at its default.
+    defaults = dict([(option.dest, option.default) for option in env_options])
+    for key in ['pool_size', 'timeout', 'connection_attempts', 'command_timeout', 'skip_bad_hosts']:
+        if key in env.conf.execution and env.get(key) == defaults.get(key):
+            env[key] = env.conf.execution[key]
+
     env.roledefs = {
         'prod': env.conf.prod['hosts'],
         'dev': env.conf.dev['hosts'],
@@ -34,28 +42,47 @@ display_header()
 
 deploy = Deploy()
 db_sync = DBSync()
+db_follow = DBFollow()
 file_sync = FileSync()
 provision = Provision()
 upgrade = Upgrade()
+warmup = Warmup()
 
 @task
-def sync(src='prod', dest='local'):
+def sync(src='prod', dest='local', concurrent=True):
     """
-    Synchronizes the database and un-versioned files from one environment to another. (src: prod, dest: local)
+    Synchronizes the database and un-versioned files from one environment to another. (src: prod, dest: local, concurrent: True)
 
     Typically this task is used to update the local environment so that it matches the production server. For more
     information on either the datbase synchronization procedure, or the way it synchronizes the files, see the
     `DBSync` and `FileSync` tasks (under `core/`). Note that this task DOES NOT copy/transfer any application code, that must be
     done instead using the "deploy" task.
 
+    The database and the files are synchronized at the same time, since they don't depend on each other. If one of them
+    fails, the other one still runs to completion, and the task fails once both are done. Set `concurrent` to False to
+    run them one after the other instead. That is also needed when connecting requires typing a password or key
+    passphrase (or accepting an unknown host key): the concurrent branches can't prompt, so they abort instead. Use
+    an SSH agent or key-based authentication to run them concurrently.
+
     Example usage:
 
     - `fab sync              # Updates local site with latest database & files from the prod site`
+    - `fab sync:prod,local,False  # Same as above, but synchronizes the database first, and then the files.`
     - `fab sync:local,dev    # NOT RECOMMENDED - have not developed/tested this functionality.`
     - `fab sync:local,prod   # NOT RECOMMENDED - have not developed/tested this functionality.`
     """
-    execute(db_sync.run, src, dest)
-    execute(file_sync.run, src, dest)
+    if str(concurrent).lower() in ['false', '0', 'no']:
+        execute(db_sync.run, src, dest)
+        execute(file_sync.run, src, dest)
+        return
+
+    summary = run_concurrently([
+        ('database', lambda: execute(db_sync.run, src, dest)),
+        ('files', lambda: execute(file_sync.run, src, dest)),
+    ])
+    failed = [name for name, _, error in summary if error]
+    if failed:
+        abort('Synchronization failed for: %s.' % ', '.join(failed))
 
 
 @task
@@ -84,10 +111,14 @@ def dump(src='prod', fetch_dump=True):
 @task
 def restart(dest='prod'):
     """
-    Executes any commands defined in the APP_RESTART_COMMANDS config value.
+    Executes any commands defined in the APP_RESTART_COMMANDS config value, then primes the caches if the WARMUP config value is set.
     """
+    deploy.cmd_data = dict(deploy.cmd_data, dest=dest)
     execute(deploy.restart, role=dest)
 
+    if env.conf.warmup:
+        warmup.run(dest)
+
 
 @task
 def test(dest='prod'):
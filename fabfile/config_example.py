@@ -85,6 +85,42 @@ POST_DEPLOY_COMMANDS = [
 ]
 
 
+"""
+Optional build stage for the deploy task (leave empty to disable). The build inputs are exported from the branch being
+deployed, the command is executed locally in a temporary folder, and the resulting output folder is uploaded into the
+same folder of each server's webroot. Builds are cached locally, keyed by the git hashes of the inputs, so the build
+is skipped when none of them have changed.
+- inputs: files & folders (relative to the repo root) that the build depends on
+- command: build command, executed from the root of the exported inputs
+- output: folder produced by the build (relative to the repo root)
+- cache_dir: local folder for the cached builds
+- max_size_mb/max_age_days: the least recently used builds are deleted when the cache exceeds either of these
+"""
+BUILD = {
+    # 'inputs': ['package.json', 'bower.json', 'Gruntfile.js', 'wp-content/themes/PROJECT_NAME/src'],
+    # 'command': 'npm install && node_modules/.bin/bower install && node_modules/.bin/grunt build',
+    # 'output': 'wp-content/themes/PROJECT_NAME/dist',
+    # 'cache_dir': '~/.cache/fabric-gitdeploy',
+    # 'max_size_mb': 500,
+    # 'max_age_days': 30,
+}
+
+
+"""
+Fan-out distribution (leave empty to disable). When set, uploads to a fleet (the unversioned folders with
+`fab rsync:local,prod`, and the BUILD output during deploys) are sent from this machine to the first few hosts only,
+which then relay them to the next ones, and so on, so the total time grows logarithmically with the number of hosts.
+The hosts copy to each other via rsync/SSH with agent forwarding, so they must be able to reach each other using the
+host strings from the `hosts` lists above.
+- degree: number of hosts each source (this machine included) sends to in every round
+- relay_ssh: SSH command used by the hosts to connect to each other
+"""
+FANOUT = {
+    # 'degree': 2,
+    # 'relay_ssh': 'ssh -o BatchMode=yes',
+}
+
+
 """
 These commands will be interpolated with the environment data provided above,
 and are not executed from a particular location, so be sure to use absolute paths.
@@ -94,6 +130,33 @@ APP_RESTART_COMMANDS = [
 ]
 
 
+"""
+Cache warm-up, executed on each node after the APP_RESTART_COMMANDS (leave empty to disable). The URLs are requested
+from each node's own web server, bypassing the load balancer. Paths are relative to the environment's `home_url`.
+- urls: static list of paths (or full URLs)
+- sitemap: path of the sitemap, every URL it lists gets added (sitemap indexes are followed one level down)
+- access_log: path of an access log on the node (combined format), the `top_n` most requested paths get added
+- address: address of the node's web server, all of the URLs' hostnames are resolved to it
+- concurrency: number of simultaneous requests per node
+- timeout: seconds before a request is given up on
+- max_error_rate: the warm-up fails if more than this ratio of the URLs return errors
+- disable_command/enable_command: executed before the restart, and after a successful warm-up (interpolated with the
+  environment data), e.g. to take the node out of the load balancer's rotation and put it back in
+"""
+WARMUP = {
+    # 'urls': ['/'],
+    # 'sitemap': 'sitemap_index.xml',
+    # 'access_log': '/var/log/nginx/access.log',
+    # 'top_n': 50,
+    # 'address': '127.0.0.1',
+    # 'concurrency': 8,
+    # 'timeout': 30,
+    # 'max_error_rate': 0.1,
+    # 'disable_command': 'rm -f %(root)s/healthcheck.txt',
+    # 'enable_command': 'touch %(root)s/healthcheck.txt',
+}
+
+
 """
 These commands will be interpolated with the variables listed below, and will be executed on
 the destination server, via bash, after the database has been inserted.
@@ -108,6 +171,66 @@ DATABASE_MIGRATION_COMMANDS = [
 ]
 
 
+"""
+Per-environment table rules, used when dumping a database that is going to be inserted into the environment named by
+the key (so `fab db:prod,local` uses the 'local' rules). The `dump` task always dumps every table, since it is meant
+for back-ups. Table names are glob patterns, and will be interpolated with `db_prefix` (the WP_PREFIX value).
+- exclude: tables that are skipped entirely (any existing copy in the destination database is left as-is)
+- structure_only: tables that are created on the destination, but without any rows
+- where: tables that only have the rows matching the WHERE clause dumped. To limit the number of rows, append a LIMIT
+  to the clause, e.g. "1 LIMIT 1000"
+"""
+DATABASE_TABLE_RULES = {
+    # 'local': {
+    #     'exclude': ['%(db_prefix)s_wfhits', '%(db_prefix)s_statistics_*'],
+    #     'structure_only': ['%(db_prefix)s_sessions', '%(db_prefix)s_actionscheduler_logs'],
+    #     'where': {
+    #         '%(db_prefix)s_options': "option_name NOT LIKE '\\_transient\\_%'",
+    #         '%(db_prefix)s_actionscheduler_actions': "status = 'pending'",
+    #     },
+    # },
+}
+
+
+"""
+Controls how the parallel tasks (updating the code, post-deploy & restart commands, provisioning) are executed across
+the hosts. Fabric handles each host in a separate process, so on a large fleet `pool_size` should be set, to limit the
+number of processes (and SSH connections/file descriptors) that exist at the same time. The equivalent `fab` command
+line options (e.g. `fab -z 50 deploy`) take precedence over the values set here.
+- pool_size: maximum number of hosts handled at the same time (default: all of them)
+- timeout: seconds to wait for a connection to a host
+- connection_attempts: number of times to try connecting to a host before giving up
+- command_timeout: seconds that a remote command may run before it is aborted (default: no limit)
+- skip_bad_hosts: skip hosts that can't be connected to, instead of aborting the whole task
+"""
+EXECUTION = {
+    # 'pool_size': 20,
+    # 'timeout': 10,
+    # 'connection_attempts': 3,
+    # 'command_timeout': 600,
+    # 'skip_bad_hosts': False,
+}
+
+
+"""
+Settings for the `db_follow` task, which keeps a database up-to-date by following the source's binlog.
+- server_id: replication ID of this machine, must be different from the ID of every server/replica of the source
+- batch_size: number of row changes applied per transaction
+- batch_interval: seconds to wait for new changes, once all of them have been applied
+- report_interval: seconds between the progress/lag reports
+- source/dest: overrides for the `db` settings of the environments, used when connecting to the databases from this
+  machine, e.g. through an SSH tunnel (`ssh -L 3307:DB_HOST_NAME:3306 user@server`)
+"""
+FOLLOW = {
+    # 'server_id': 4242,
+    # 'batch_size': 500,
+    # 'batch_interval': 1,
+    # 'report_interval': 10,
+    # 'source': {'host': '127.0.0.1', 'port': 3307},
+    # 'dest': {},
+}
+
+
 """
 This controls whether the header is shown or not
 """
@@ -127,6 +250,24 @@ def HEADER_FN():
 
 
 """
-Controls output of the `run()` commands. For verbose output, set this to `False`.
+Controls output of the `run()` commands. For verbose output, set this to `False`. Quiet commands also don't abort the
+task when they fail (they only cause a warning), which includes the deploy's update, post-deploy & restart commands.
 """
 QUIET_COMMANDS = True
+
+
+"""
+Controls how the output of the long-running commands (database dump/insert/migration, rsync, deploy scripts) is
+handled. The output is appended to a log file per host, and only the last lines are kept in memory, to be displayed
+if a command fails. When QUIET_COMMANDS is `False`, the output is also displayed on the console.
+- log_dir: folder for the log files (default: `logs/` inside of the LOCAL archive folder)
+- buffer_lines: number of lines displayed when a command fails
+- filters: regular expressions, matching lines are written to the log file, but not displayed
+- max_lines_per_second: lines displayed per second & host, the rest are only written to the log file
+"""
+OUTPUT = {
+    # 'log_dir': '/www/_archive/%s/logs' % PROJECT_NAME,
+    # 'buffer_lines': 200,
+    # 'filters': [r'^sending incremental file list$', r'/$'],
+    # 'max_lines_per_second': 20,
+}
@@ -1,5 +1,7 @@
 from .deploy import Deploy
 from .db_sync import DBSync
+from .db_follow import DBFollow
 from .file_sync import FileSync
 from .provision import Provision
 from .upgrade import Upgrade
+from .warmup import Warmup
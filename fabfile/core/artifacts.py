@@ -0,0 +1,106 @@
+"""
+This file contains the local cache for build artifacts (compiled front-end assets, etc).
+"""
+# Fabric/Global Imports
+from fabric.api import env, local, lcd, quiet, abort
+from fabfile.core.output import stream_local
+import glob
+import hashlib
+import os
+import shutil
+import tempfile
+import time
+
+
+class ArtifactCache(object):
+    """
+    Builds the output of the BUILD config value, and caches it locally as a tarball, keyed by the git tree hashes of
+    the build's inputs (and the build command). As long as none of the inputs change, the build is skipped entirely
+    and the cached tarball is re-used.
+
+    Example usage:
+
+    - `artifact_fn = ArtifactCache().get('master')`
+    """
+
+    def __init__(self):
+        self.conf = env.conf.build
+        self.cache_dir = os.path.expanduser(self.conf.get('cache_dir', '~/.cache/fabric-gitdeploy'))
+
+
+    def get(self, branch):
+        """
+        Returns the path of the artifact for `branch`, building it first if it isn't in the cache yet.
+        :param branch: local git branch (or any other revision) to build
+        """
+        key = self.make_key(branch)
+        artifact_fn = os.path.join(self.cache_dir, '%s.tar.gz' % key)
+        if os.path.exists(artifact_fn):
+            print('Using cached build %s...' % key[:12])
+            # Refresh the modification time, it's what the eviction is based on.
+            os.utime(artifact_fn, None)
+        else:
+            self.build(branch, artifact_fn)
+        self.evict(keep=artifact_fn)
+        return artifact_fn
+
+
+    def make_key(self, branch):
+        """
+        Returns the cache key for `branch`: a hash of the build command, the output folder, and the git object hashes
+        of each of the build's inputs (files or folders) at that revision.
+        :param branch: local git branch (or any other revision)
+        """
+        key = hashlib.sha1()
+        key.update(('%s\n%s\n' % (self.conf['command'], self.conf['output'])).encode('utf-8'))
+        with lcd(env.local['root']), quiet():
+            for path in self.conf['inputs']:
+                result = local('git rev-parse %s:%s' % (branch, path), capture=True)
+                if result.failed:
+                    abort('Build input `%s` was not found in %s.' % (path, branch))
+                key.update(('%s %s\n' % (path, result.strip())).encode('utf-8'))
+        return key.hexdigest()
+
+
+    def build(self, branch, artifact_fn):
+        """
+        Exports the build's inputs from `branch` into a temporary folder, runs the build command there, and stores
+        the output folder as a tarball at `artifact_fn`.
+        :param branch: local git branch (or any other revision)
+        :param artifact_fn: path of the tarball to create
+        """
+        print('Building %s...' % self.conf['output'])
+        build_dir = tempfile.mkdtemp(prefix='fab-build-')
+        try:
+            with lcd(env.local['root']):
+                local('git archive %s %s | tar -x -C %s' % (branch, ' '.join(self.conf['inputs']), build_dir))
+            with lcd(build_dir):
+                stream_local(self.conf['command'])
+
+            if not os.path.isdir(self.cache_dir):
+                os.makedirs(self.cache_dir)
+            # Write to a temporary name first, so that an interrupted build never leaves a partial artifact behind.
+            local('tar -czf %s.tmp -C %s .' % (artifact_fn, os.path.join(build_dir, self.conf['output'])))
+            os.rename(artifact_fn + '.tmp', artifact_fn)
+        finally:
+            shutil.rmtree(build_dir, ignore_errors=True)
+
+
+    def evict(self, keep=None):
+        """
+        Deletes the artifacts that haven't been used for more than BUILD['max_age_days'], then the least recently used
+        ones until the cache is under BUILD['max_size_mb'].
+        :param keep: path of an artifact that must not be deleted (the one that is about to be deployed)
+        """
+        max_age = self.conf.get('max_age_days', 30) * 24 * 60 * 60
+        max_size = self.conf.get('max_size_mb', 500) * 1024 * 1024
+        artifacts = sorted([(os.path.getmtime(fn), os.path.getsize(fn), fn)
+                            for fn in glob.glob(os.path.join(self.cache_dir, '*.tar.gz'))])
+        total_size = sum([size for _, size, _ in artifacts])
+        for mtime, size, fn in artifacts:
+            if time.time() - mtime <= max_age and total_size <= max_size:
+                break
+            if fn == keep:
+                continue
+            os.remove(fn)
+            total_size -= size
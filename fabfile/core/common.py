@@ -3,6 +3,18 @@ This file is a catch-all location for any helper functions needed by this packag
 """
 # Fabric/Global Imports
 from fabric.api import quiet, env
+from fabric.state import connections
+import multiprocessing
+import time
+
+try:
+    from Queue import Empty
+except ImportError:
+    from queue import Empty
+
+# rsync's exit code for "some files vanished before they could be transferred", which is routine when syncing a live
+# uploads folder, so it is treated as a warning rather than a failure.
+RSYNC_VANISHED_FILES = 24
 
 
 def filter_quiet_commands(cmd):
@@ -28,3 +40,86 @@ def display_header():
     if env.conf.show_header and len(env.conf.header) > 0:
         for line in env.conf.header:
             print(line)
+
+
+def run_concurrently(branches, interval=10):
+    """
+    Runs several independent callables at the same time, each one in its own process (the same way Fabric runs its
+    `@parallel` tasks). A combined progress line is printed every `interval` seconds, and a summary of each branch's
+    duration is printed once they have all finished. A branch that fails does not stop the others, instead its error
+    is reported in the summary. The branches can't prompt for anything (passwords, key passphrases, unknown host
+    keys), they abort instead, so authentication has to work non-interactively. Returns a list of (name, duration,
+    error) tuples, in the same order as `branches`.
+
+    Example usage:
+
+    - run_concurrently([('database', lambda: execute(db_sync.run)), ('files', lambda: execute(file_sync.run))])
+    """
+    queue = multiprocessing.Queue()
+    processes = []
+    start = time.time()
+    for name, fn in branches:
+        process = multiprocessing.Process(target=_run_branch, args=(name, fn, queue))
+        process.start()
+        processes.append((name, process))
+
+    results = dict()
+
+    def add_result(name, duration, error):
+        results[name] = (duration, error)
+        print('[%s] %s after %.1fs.' % (name, 'Failed' if error else 'Finished', duration))
+
+    while len(results) < len(processes):
+        try:
+            add_result(*queue.get(timeout=interval))
+        except Empty:
+            # A branch can finish right after the timeout. Its result is in the queue by the time its process has
+            # exited, so the queue is drained after checking which processes have exited, but before declaring any
+            # of them failed.
+            exited = [name for name, process in processes if not process.is_alive()]
+            try:
+                while True:
+                    add_result(*queue.get_nowait())
+            except Empty:
+                pass
+            status = []
+            for name, process in processes:
+                if name in results:
+                    status.append('%s: done' % name)
+                elif name in exited:
+                    # The process died without reporting back (killed, segfault, etc).
+                    results[name] = (time.time() - start, 'exited with code %s' % process.exitcode)
+                    status.append('%s: failed' % name)
+                else:
+                    status.append('%s: running' % name)
+            print('[%ds] %s' % (time.time() - start, ', '.join(status)))
+
+    for name, process in processes:
+        process.join()
+
+    print('Summary (%.1fs total):' % (time.time() - start))
+    summary = []
+    for name, process in processes:
+        duration, error = results[name]
+        print('- %s: %s in %.1fs%s' % (name, 'FAILED' if error else 'OK', duration, ' (%s)' % error if error else ''))
+        summary.append((name, duration, error))
+    return summary
+
+
+def _run_branch(name, fn, queue):
+    """
+    Process target for `run_concurrently()`, reports the branch's duration and error (if any) back through `queue`.
+    """
+    # Connections opened by the parent process can't be shared, they get re-established when needed.
+    connections.clear()
+    # multiprocessing replaces the child's stdin with /dev/null, so any password/passphrase/host key prompt would just
+    # fail with an EOF error. Aborting gives a clear message instead.
+    env.abort_on_prompts = True
+    start = time.time()
+    error = None
+    try:
+        fn()
+    except BaseException as e:
+        # Fabric's `abort()` raises SystemExit, so that has to be caught too.
+        error = '%s: %s' % (e.__class__.__name__, e)
+    queue.put((name, time.time() - start, error))
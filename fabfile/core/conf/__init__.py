@@ -50,6 +50,13 @@ class Config(ConfigBase):
     post_deploy_commands = Commands()
     app_restart_commands = Commands()
     database_migration_commands = Commands()
+    database_table_rules = dict()
+    warmup = dict()
+    execution = dict()
+    output = dict()
+    build = dict()
+    fanout = dict()
+    follow = dict()
     header = Header()
 
     def __init__(self, config):
@@ -59,6 +66,13 @@ class Config(ConfigBase):
         self.post_deploy_commands = config.POST_DEPLOY_COMMANDS
         self.app_restart_commands = config.APP_RESTART_COMMANDS
         self.database_migration_commands = config.DATABASE_MIGRATION_COMMANDS
+        self.database_table_rules = getattr(config, 'DATABASE_TABLE_RULES', dict())
+        self.warmup = getattr(config, 'WARMUP', dict())
+        self.execution = getattr(config, 'EXECUTION', dict())
+        self.output = getattr(config, 'OUTPUT', dict())
+        self.build = getattr(config, 'BUILD', dict())
+        self.fanout = getattr(config, 'FANOUT', dict())
+        self.follow = getattr(config, 'FOLLOW', dict())
         self.show_header = config.SHOW_HEADER
         self.quiet_commands = config.QUIET_COMMANDS
         self.header = config.HEADER
@@ -0,0 +1,266 @@
+"""
+This file contains the continuous database replication task.
+"""
+# Fabric/Global Imports
+from fabric.api import env, run, execute, hosts, abort
+from fabric.tasks import Task
+from fabfile.core.db_sync import DBSync
+import os
+import re
+import time
+
+
+class DBFollow(Task):
+    """
+    Copies the database from one server to another, then keeps it up-to-date by following the binlog. (src: prod, dest: local, resume: False)
+    """
+    name = 'db_follow'
+
+    def __init__(self, *args, **kwargs):
+        super(DBFollow, self).__init__(*args, **kwargs)
+        self.db_sync = DBSync()
+
+
+    def run(self, src='prod', dest='local', resume=False, *args, **kwargs):
+        """
+        Copies the database from one server to another, then keeps it up-to-date by following the binlog. (src: prod, dest: local, resume: False)
+
+        This starts with the same dump/insert/migrate procedure as the "db" task (including any DATABASE_TABLE_RULES),
+        except that the dump also records the source's binlog position. From that position on, the source's binlog is
+        read continuously, and the changed rows are applied to the destination database in batches. Whenever rows of
+        the options table change, the DATABASE_MIGRATION_COMMANDS are executed again, so the URLs stay correct. The
+        replication lag is reported periodically. Press Ctrl-C to stop; the position is saved, so that the replication
+        can be resumed later without a new dump.
+
+        Requirements:
+
+        - the `mysql-replication` Python package (`pip install mysql-replication`)
+        - the source server must have binary logging enabled, with `binlog_format = ROW`
+        - the source database user needs the REPLICATION SLAVE, REPLICATION CLIENT & RELOAD privileges (RELOAD is
+          needed by mysqldump to record the binlog position of the initial dump)
+        - this machine needs to be able to connect to both databases (see the `source`/`dest` settings of the FOLLOW
+          config value, e.g. for going through an SSH tunnel)
+
+        Schema changes (ALTER TABLE, etc.) are not replicated, run the "db" task again after those. Changes to the
+        tables that the destination's DATABASE_TABLE_RULES exclude, dump structure-only, or limit with a WHERE clause
+        are not replicated either, since the rules can't be evaluated against the streamed rows.
+
+        Example usage:
+
+        - `fab db_follow                  # Copies the prod database to the local one, then keeps following it.`
+        - `fab db_follow:prod,local,True  # Resumes following from the last saved position, without a new dump.`
+        """
+        if src == 'local':
+            raise ValueError('Using the local database as a source is not currently supported.')
+
+        try:
+            import pymysql
+            from pymysqlreplication import BinLogStreamReader
+            from pymysqlreplication.event import QueryEvent, XidEvent
+            from pymysqlreplication.row_event import WriteRowsEvent, UpdateRowsEvent, DeleteRowsEvent
+        except ImportError as e:
+            raise ImportError('The db_follow task requires the mysql-replication package. ' + str(e))
+
+        position_fn = self.get_position_fn(src, dest)
+        if str(resume).lower() in ['true', '1', 'yes'] and os.path.exists(position_fn):
+            with open(position_fn) as f:
+                log_file, log_pos = f.read().split()
+            log_pos = int(log_pos)
+            print('Resuming from %s:%d...' % (log_file, log_pos))
+        else:
+            log_file, log_pos = self.snapshot(src, dest)
+            self.save_position(position_fn, log_file, log_pos)
+
+        conf = env.conf.follow
+        source_db = dict(env[src]['db'], **conf.get('source', {}))
+        dest_db = dict(env[dest]['db'], **conf.get('dest', {}))
+        connection = pymysql.connect(host=dest_db['host'], port=int(dest_db.get('port', 3306)), user=dest_db['user'],
+                                     passwd=dest_db['password'], db=dest_db['name'], charset='utf8mb4')
+        stream = BinLogStreamReader(
+            connection_settings=dict(host=source_db['host'], port=int(source_db.get('port', 3306)),
+                                     user=source_db['user'], passwd=source_db['password']),
+            server_id=int(conf.get('server_id', 4242)),
+            only_events=[WriteRowsEvent, UpdateRowsEvent, DeleteRowsEvent, XidEvent, QueryEvent],
+            only_schemas=[source_db['name']],
+            log_file=log_file,
+            log_pos=log_pos,
+            resume_stream=True,
+            blocking=False,
+        )
+
+        batch_size = int(conf.get('batch_size', 500))
+        report_interval = conf.get('report_interval', 10)
+        skipped_tables = self.get_skipped_tables(dest)
+        options_table = '%s_options' % env.conf.wp_prefix
+        # Positions are only saved at the end of a transaction: resuming from the middle of one would skip the rows
+        # whose table map event came before that position.
+        position = (log_file, log_pos)
+        saved_position = position
+        batch = []
+        affected_tables = set()
+        applied_rows = 0
+        lag = 0
+        last_report = time.time()
+        print('Following the %s database (Ctrl-C to stop)...' % src)
+        try:
+            while True:
+                # Without `blocking`, the iteration ends once the binlog has been read up to its current end, so
+                # a partial batch never waits for more events.
+                for event in stream:
+                    lag = max(0, time.time() - event.timestamp)
+                    if isinstance(event, (XidEvent, QueryEvent)):
+                        # XID ends InnoDB transactions, a COMMIT query ends the ones of non-transactional tables.
+                        if isinstance(event, XidEvent) or event.query == 'COMMIT':
+                            position = (stream.log_file, stream.log_pos)
+                            if len(batch) >= batch_size:
+                                break
+                        continue
+                    if self.db_sync.match_tables([event.table], skipped_tables):
+                        continue
+                    batch.extend(self.make_row_sql(event, UpdateRowsEvent, DeleteRowsEvent))
+                    affected_tables.add(event.table)
+
+                if len(batch):
+                    self.apply_batch(connection, batch, dest, options_table in affected_tables)
+                    self.save_position(position_fn, *position)
+                    saved_position = position
+                    applied_rows += len(batch)
+                    batch = []
+                    affected_tables = set()
+                else:
+                    lag = 0
+                    time.sleep(conf.get('batch_interval', 1))
+
+                if time.time() - last_report >= report_interval:
+                    print('Applied %d row changes, lag: %.1fs, position: %s:%s' % ((applied_rows, lag) + saved_position))
+                    last_report = time.time()
+        except KeyboardInterrupt:
+            print('Stopped at %s:%s, run `fab db_follow:%s,%s,True` to resume.' % (saved_position + (src, dest)))
+        finally:
+            stream.close()
+            connection.close()
+
+
+    def snapshot(self, src, dest):
+        """
+        Dumps, inserts & migrates the database, like the "db" task does, and returns the binlog position (log file,
+        log position) that the dump was taken at.
+        :param src: source server (prod, dev)
+        :param dest: destination server (local, prod, dev)
+        """
+        if dest == 'local':
+            dump_result = execute(self.db_sync.dump_fetch, src, dest, True, hosts=env[src]['hosts'][0])
+            insert_dump_fn = dump_result.popitem()[1][0]
+        else:
+            dump_result = execute(self.db_sync.dump, src, dest, True, hosts=env[src]['hosts'][0])
+            _, insert_dump_fn = dump_result.popitem()[1]
+
+        position = execute(self.read_position, insert_dump_fn, hosts=env[dest]['hosts'][0]).popitem()[1]
+        execute(self.db_sync.insert_db, dest, insert_dump_fn, hosts=env[dest]['hosts'][0])
+        execute(self.db_sync.migrate, dest, hosts=env[dest]['hosts'][0])
+        return position
+
+
+    @hosts([])  # local
+    def read_position(self, fn):
+        """
+        Returns the binlog position (log file, log position) from the `CHANGE MASTER TO` comment at the top of a dump,
+        or the `CHANGE REPLICATION SOURCE TO` one that MySQL 8.0.26+ writes instead.
+        :param fn: filename of the dump (expecting a .sql.gz file)
+        """
+        output = run('gunzip < %s | head -n 100 | grep -m 1 -E "CHANGE (MASTER|REPLICATION SOURCE) TO"' % fn,
+                     quiet=True)
+        match = re.search(r"(?:MASTER|SOURCE)_LOG_FILE='([^']+)', (?:MASTER|SOURCE)_LOG_POS=(\d+)", output)
+        if not match:
+            abort('The binlog position was not found in %s, is binary logging enabled on the source server?' % fn)
+        return match.group(1), int(match.group(2))
+
+
+    def get_skipped_tables(self, dest):
+        """
+        Returns the table patterns that are excluded, structure-only, or limited by a WHERE clause in the destination's
+        DATABASE_TABLE_RULES. Changes to those tables are not replicated, otherwise the rows that the rules kept out
+        of the initial dump would come back.
+        :param dest: destination server (local, prod, dev)
+        """
+        rules = env.conf.database_table_rules.get(dest) or dict()
+        return list(rules.get('exclude', [])) + list(rules.get('structure_only', [])) + list(rules.get('where', {}))
+
+
+    def make_row_sql(self, event, update_event_class, delete_event_class):
+        """
+        Returns a list of (sql, params) tuples that apply the rows of a binlog row event. Updated rows are deleted (by
+        their primary key, or by all of their old values if the table has none) and inserted again.
+        :param event: a WriteRowsEvent, UpdateRowsEvent or DeleteRowsEvent
+        """
+        table = quote_name(event.table)
+        primary_key = event.primary_key
+        if primary_key and not isinstance(primary_key, (list, tuple)):
+            primary_key = [primary_key]
+
+        def delete(values):
+            columns = primary_key or list(values.keys())
+            where = ' AND '.join(['%s <=> %%s' % quote_name(column) for column in columns])
+            return ('DELETE FROM %s WHERE %s LIMIT 1' % (table, where), [values[column] for column in columns])
+
+        def insert(values):
+            columns = list(values.keys())
+            return ('REPLACE INTO %s (%s) VALUES (%s)' % (table, ', '.join([quote_name(c) for c in columns]),
+                                                          ', '.join(['%s'] * len(columns))),
+                    [values[column] for column in columns])
+
+        sql = []
+        for row in event.rows:
+            if isinstance(event, update_event_class):
+                sql.extend([delete(row['before_values']), insert(row['after_values'])])
+            elif isinstance(event, delete_event_class):
+                sql.append(delete(row['values']))
+            else:
+                sql.append(insert(row['values']))
+        return sql
+
+
+    def apply_batch(self, connection, batch, dest, migrate):
+        """
+        Applies a batch of (sql, params) tuples to the destination database in a single transaction, followed by the
+        DATABASE_MIGRATION_COMMANDS when `migrate` is set.
+        :param connection: connection to the destination database
+        :param batch: list of (sql, params) tuples, as returned by `make_row_sql()`
+        :param dest: destination server (local, prod, dev)
+        :param migrate: whether the options table was affected
+        """
+        cursor = connection.cursor()
+        try:
+            for sql, params in batch:
+                cursor.execute(sql, params)
+            if migrate:
+                migration_sql = self.db_sync.make_update_sql(env[dest]['db']['name'], home_url=env[dest]['home_url'],
+                                                             wp_url=env[dest]['wp_url'])
+                for sql in migration_sql:
+                    cursor.execute(sql)
+            connection.commit()
+        except Exception:
+            connection.rollback()
+            raise
+        finally:
+            cursor.close()
+
+
+    def get_position_fn(self, src, dest):
+        """
+        Returns the path of the file that the current binlog position is saved in, inside the local archive folder.
+        """
+        return os.path.join(os.path.expanduser(env['local']['archive']),
+                            '%s.%s-%s.binlog-position' % (env.conf.project_name, src, dest))
+
+
+    def save_position(self, fn, log_file, log_pos):
+        with open(fn, 'w') as f:
+            f.write('%s %s\n' % (log_file, log_pos))
+
+
+def quote_name(name):
+    """
+    Quotes a MySQL identifier (table or column name).
+    """
+    return '`%s`' % name.replace('`', '``')
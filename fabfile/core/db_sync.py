@@ -2,8 +2,11 @@
 This file contains the database synchronization task.
 """
 # Fabric/Global Imports
-from fabric.api import env, run, quiet, execute, hosts, get
+from fabric.api import env, run, quiet, execute, hosts, get, abort
 from fabric.tasks import Task
+from fnmatch import fnmatchcase
+from fabfile.core.output import stream_run
+import pipes
 import time
 
 
@@ -39,6 +42,9 @@ class DBSync(Task):
         destination server, and then updating a few database entries to make WordPress work on the destination server
         (like wp_options/home, and wp_options/siteurl).
 
+        Any DATABASE_TABLE_RULES defined for the destination are applied to the dump, which can be used to skip large
+        tables (sessions, logs, analytics, etc), or to only copy their structure or a subset of their rows.
+
         Example usage:
 
         - `fab db            # Runs task with the default parameters, same as the following:`
@@ -51,9 +57,9 @@ class DBSync(Task):
             raise ValueError('Using the local database as a source is not currently supported.')
 
         if dest == 'local':
-            dump_result = execute(self.dump_fetch, src, hosts=env[src]['hosts'][0])
+            dump_result = execute(self.dump_fetch, src, dest, hosts=env[src]['hosts'][0])
         else:
-            dump_result = execute(self.dump, src, hosts=env[src]['hosts'][0])
+            dump_result = execute(self.dump, src, dest, hosts=env[src]['hosts'][0])
 
         insert_dump_fn = dump_result.popitem()[1][0]
         execute(self.insert_db, dest, insert_dump_fn, hosts=env[dest]['hosts'][0])
@@ -71,12 +77,12 @@ class DBSync(Task):
         insert_cmd = 'mysql -u %(user)s -p%(password)s -h %(host)s %(name)s' % env[dest]['db']
         cmd = 'gunzip < %s | %s' % (insert_dump_fn, insert_cmd)
         print('Inserting database....')
-        run(cmd, quiet=env.conf.quiet_commands)
+        stream_run(cmd)
 
 
     @hosts([])  # prod
-    def dump_fetch(self, src):
-        dump_result = execute(self.dump, src, hosts=env[src]['hosts'][0])
+    def dump_fetch(self, src, dest=None, master_data=False):
+        dump_result = execute(self.dump, src, dest, master_data, hosts=env[src]['hosts'][0])
         _, dump_full_fn = dump_result.popitem()[1]
         fetch_result = execute(self.fetch, dump_full_fn, hosts=env[src]['hosts'][0])
         return fetch_result.popitem()[1]
@@ -97,7 +103,7 @@ class DBSync(Task):
 
 
     @hosts([])  # prod
-    def dump(self, src='prod'):
+    def dump(self, src='prod', dest=None, master_data=False):
         """
         Dumps a database, then downloads it to `backup/` folder. Useful for performing back-ups. (src: prod, fetch_dump: True)
 
@@ -111,19 +117,89 @@ class DBSync(Task):
         have space constraints, you'll need to manually go in and purge the `archives` directory (which is defined at the
         top of this file).
         :param src: source server (local, prod, dev)
+        :param dest: the environment the dump is intended for, used to look up its DATABASE_TABLE_RULES. When this is
+            omitted (as it is for back-ups), every table is dumped in full.
+        :param master_data: dump from a consistent snapshot, and record its binlog position in the dump (see the
+            "db_follow" task). This requires the RELOAD privilege.
         """
-        cmd_vars = env[src]['db']
-        dump_cmd = 'mysqldump -u %(user)s -p%(password)s -h %(host)s %(name)s' % cmd_vars
+        dump_cmd = self.make_dump_cmd(src, dest, master_data)
         dump_fn_stem = '%s-%s.%s' % (env.conf.project_name, time.strftime("%Y.%m.%d-%H.%M.%S"), src)
         dump_fn = '%s.sql.gz' % dump_fn_stem
         dump_full_fn = '%s/%s' % (env[src]['archive'], dump_fn)
-        cmd = '%s | gzip > %s' % (dump_cmd, dump_full_fn)
+        # With `pipefail`, a failing mysqldump fails the whole command (instead of just gzip's exit status counting),
+        # and the incomplete dump gets deleted, so it can never be inserted.
+        cmd = 'set -o pipefail; (%s) | gzip > %s || { rm -f %s; exit 1; }' % (dump_cmd, dump_full_fn, dump_full_fn)
         print('Dumping database...')
-        run(cmd, quiet=env.conf.quiet_commands)
+        stream_run(cmd)
 
         return dump_fn, dump_full_fn
 
 
+    def make_dump_cmd(self, src, dest=None, master_data=False):
+        """
+        Generates the mysqldump command(s) for the `src` database, applying the DATABASE_TABLE_RULES defined for the
+        `dest` environment. Excluded tables are skipped entirely, structure-only tables are dumped without any rows,
+        and tables with a WHERE clause only get their matching rows dumped. Each of those groups is a separate
+        mysqldump call, the commands are chained with `&&` so that their output can be piped into a single file, and
+        so that the first one that fails (e.g. because of a bad WHERE clause) stops the dump.
+        :param src: source server (local, prod, dev)
+        :param dest: destination server (local, prod, dev), or None to dump every table
+        :param master_data: add the binlog position (as a `CHANGE MASTER TO`/`CHANGE REPLICATION SOURCE TO` comment) to
+            the first mysqldump's output
+        """
+        db = env[src]['db']
+        dump_prefix = 'mysqldump -u %(user)s -p%(password)s -h %(host)s' % db
+        # MySQL 8.0.26 renamed `--master-data` to `--source-data` (and deprecated the old name), older versions and
+        # MariaDB only know `--master-data`, so the option is picked by what the installed mysqldump supports.
+        first_opts = (' --single-transaction $(mysqldump --help | grep -- --source-data > /dev/null && '
+                      'echo --source-data=2 || echo --master-data=2)') if master_data else ''
+        rules = env.conf.database_table_rules.get(dest) if dest is not None else None
+        if not rules:
+            return '%s%s %s' % (dump_prefix, first_opts, db['name'])
+
+        tables = self.get_tables(src)
+        excluded = self.match_tables(tables, rules.get('exclude', []))
+        structure_only = self.match_tables(tables, rules.get('structure_only', [])) - excluded
+        where = dict()
+        for pattern, clause in rules.get('where', {}).items():
+            for table in self.match_tables(tables, [pattern]) - excluded - structure_only:
+                where[table] = clause
+
+        ignored = sorted(excluded | structure_only | set(where))
+        ignore_opts = ''.join([' --ignore-table=%s.%s' % (db['name'], table) for table in ignored])
+        cmds = ['%s%s%s %s' % (dump_prefix, first_opts, ignore_opts, db['name'])]
+        if structure_only:
+            cmds.append('%s --no-data %s %s' % (dump_prefix, db['name'], ' '.join(sorted(structure_only))))
+        for table in sorted(where):
+            cmds.append('%s --where=%s %s %s' % (dump_prefix, pipes.quote(where[table]), db['name'], table))
+        return ' && '.join(cmds)
+
+
+    def get_tables(self, src):
+        """
+        Returns the names of the tables in the `src` database. This runs on the current host, which is expected to be
+        the same host that the database gets dumped from.
+        :param src: source server (local, prod, dev)
+        """
+        cmd = 'mysql -u %(user)s -p%(password)s -h %(host)s %(name)s -s -N -e "SHOW TABLES"' % env[src]['db']
+        output = run(cmd, quiet=True)
+        if output.failed:
+            # Otherwise the error message would be parsed as table names, and none of the rules would apply.
+            abort('Listing the tables of the %s database failed: %s' % (src, output))
+        return [line.strip() for line in output.splitlines() if line.strip()]
+
+
+    def match_tables(self, tables, patterns):
+        """
+        Returns the set of `tables` that match any of the glob `patterns`. The patterns are interpolated with
+        `db_prefix` (the WP_PREFIX config value) before matching, e.g. '%(db_prefix)s_actionscheduler_*'.
+        :param tables: list of table names
+        :param patterns: list of glob patterns
+        """
+        patterns = [pattern % dict(db_prefix=env.conf.wp_prefix) for pattern in patterns]
+        return set([table for table in tables if any([fnmatchcase(table, pattern) for pattern in patterns])])
+
+
     @hosts([])  # local
     def migrate(self, dest='local'):
         """
@@ -144,7 +220,7 @@ class DBSync(Task):
         print('Running MySQL migration commands...')
         for query in sql:
             cmd = cmd_prefix + (' -s -N -e "%s"' % query)
-            run(cmd, quiet=env.conf.quiet_commands)
+            stream_run(cmd)
 
 
     def make_update_sql(self, db_name, *args, **kwargs):
@@ -2,9 +2,17 @@
 This file contains the deploy task.
 """
 # Fabric/Global Imports
-from fabric.api import env, run, local, cd, lcd, quiet, execute, parallel, roles
+from fabric.api import env, run, local, cd, lcd, quiet, execute, parallel, roles, put
 from fabric.tasks import Task
+from fabfile.core.artifacts import ArtifactCache
 from fabfile.core.common import filter_quiet_commands
+from fabfile.core.fanout import distribute
+from fabfile.core.output import stream_run
+from fabfile.core.remote_script import RemoteScript
+from fabfile.core.warmup import Warmup
+import shutil
+import tempfile
+import uuid
 
 
 class Deploy(Task):
@@ -12,7 +20,7 @@ class Deploy(Task):
     Deploys your local code to a remote server. (dest: prod, branch: master, dest_branch: master)
     """
     name = "deploy"
-    cmd_data = dict(branch=None, dest=None, dest_branch=None)
+    cmd_data = dict(branch=None, dest=None, dest_branch=None, artifact=None)
     
     def __init__(self, *args, **kwargs):
         super(Deploy, self).__init__(*args, **kwargs)
@@ -25,7 +33,12 @@ class Deploy(Task):
         This task pushes your local git repo to the destination server, then updates the destination's webroot via
         `git pull`. Then it executes any post-deployment tasks, like setting file permissions, as well as deleting any
         sensitive files from the webroot (.git files, Gruntfile, Vagrant configs, etc. See the `_post_deploy()` function
-        for more info), restarting PHP (to flush the opcode cache), and flushing the Varnish cache.
+        for more info), restarting PHP (to flush the opcode cache), and flushing the Varnish cache. Finally, if the
+        WARMUP config value is set, the caches get primed again (see the "warmup" task).
+
+        If the BUILD config value is set, the front-end assets are built once locally (or taken from the local build
+        cache, when none of the build's inputs have changed), and the result is uploaded to each server right after its
+        code has been updated.
 
         Example usage:
 
@@ -33,16 +46,26 @@ class Deploy(Task):
         - `fab deploy:prod   # Same as above, as "prod" is the default destination.`
         - `fab deploy:dev    # Deploys code to the dev server`
         """
-        self.cmd_data = dict(branch=branch, dest=dest, dest_branch=dest_branch)
+        self.cmd_data = dict(branch=branch, dest=dest, dest_branch=dest_branch, artifact=None)
         
         execute(self.push_app)
+
+        if env.conf.build:
+            self.cmd_data['artifact'] = ArtifactCache().get(branch)
+
         execute(self.update_remote, role=dest)
+
+        if self.cmd_data['artifact'] and env.conf.fanout:
+            self.distribute_artifact()
         
         if len(env.conf.post_deploy_commands):
             execute(self.post_deploy, role=dest)
             
         if len(env.conf.app_restart_commands):
             execute(self.restart, role=dest)
+
+        if env.conf.warmup:
+            Warmup().run(dest)
         
         
     @roles('local')
@@ -66,8 +89,50 @@ class Deploy(Task):
         with cd(env[dest]['root']):
             # note the dependency on the remote name "origin"
             print('Updating destination from %(dest)s:%(dest_branch)s...' % self.cmd_data)
-            run('git reset --hard && git pull origin %(dest_branch)s' % self.cmd_data, quiet=env.conf.quiet_commands)
-        pass
+            steps = RemoteScript('update', ['git reset --hard && git pull origin %(dest_branch)s' % self.cmd_data]) \
+                .execute(warn_only=env.conf.quiet_commands)
+
+        if self.cmd_data.get('artifact') and not env.conf.fanout:
+            self.ship_artifact()
+        return steps
+
+
+    def ship_artifact(self):
+        """
+        Uploads the build artifact to the current host, and extracts it into the BUILD['output'] folder of the webroot.
+        The artifact is extracted into a new folder which then replaces the old one, so files from previous builds
+        don't pile up. This is executed as part of `update_remote()`, so the artifact gets shipped to all of the hosts
+        in parallel.
+        """
+        dest = self.cmd_data['dest']
+        cmd_vars = dict(output_dir='%s/%s' % (env[dest]['root'], env.conf.build['output']),
+                        remote_fn='/tmp/fab-artifact-%s.tar.gz' % uuid.uuid4().hex)
+        print('Uploading build artifact...')
+        put(self.cmd_data['artifact'], cmd_vars['remote_fn'])
+        # The uploaded tarball (and a partially extracted folder) gets cleaned up, whether the extraction worked or not.
+        stream_run('rm -rf %(output_dir)s.new %(output_dir)s.old && mkdir -p %(output_dir)s.new && '
+                   'tar -xzf %(remote_fn)s -C %(output_dir)s.new && '
+                   '{ [ ! -e %(output_dir)s ] || mv %(output_dir)s %(output_dir)s.old; } && '
+                   'mv %(output_dir)s.new %(output_dir)s && rm -rf %(output_dir)s.old; '
+                   '_fab_rc=$?; rm -rf %(remote_fn)s %(output_dir)s.new; exit $_fab_rc' % cmd_vars)
+
+
+    def distribute_artifact(self):
+        """
+        Extracts the build artifact locally, and distributes its contents into the BUILD['output'] folder of every
+        host's webroot, with the hosts that already have it relaying it to the next ones (see `fanout.distribute()`).
+        This replaces `ship_artifact()` when the FANOUT config value is set.
+        """
+        dest = self.cmd_data['dest']
+        output_dir = tempfile.mkdtemp(prefix='fab-artifact-')
+        try:
+            local('tar -xzf %s -C %s' % (self.cmd_data['artifact'], output_dir))
+            print('Distributing build artifact...')
+            # `--delete` removes the files of previous builds, like `ship_artifact()` does.
+            distribute(output_dir, '%s/%s' % (env[dest]['root'], env.conf.build['output']), env.roledefs[dest],
+                       rsync_options='-az --delete')
+        finally:
+            shutil.rmtree(output_dir, ignore_errors=True)
     
     
     @parallel
@@ -76,20 +141,27 @@ class Deploy(Task):
         """
         Executes the commands defined in env.conf.post_deploy_commands, from the config.py 
         file. Typically this would be a good place to set file permissions, file  
-        cleanup, etc.
+        cleanup, etc. All of the commands are executed with a single remote script, see `RemoteScript`. When
+        QUIET_COMMANDS is set, a failing command only causes a warning, like with `run(quiet=True)`.
         """
         dest = self.cmd_data['dest']
         with cd(env[dest]['root']):
-            for cmd in env.conf.post_deploy_commands:
-                run(cmd % env[dest], quiet=env.conf.quiet_commands)                
+            commands = [cmd % env[dest] for cmd in env.conf.post_deploy_commands]
+            return RemoteScript('post-deploy', commands).execute(warn_only=env.conf.quiet_commands)
 
 
     @parallel
     @roles('prod')
     def restart(self):
         """
-        Executes any commands defined in the env.conf.app_restart_commands config value.
+        Executes any commands defined in the env.conf.app_restart_commands config value. All of the commands are
+        executed with a single remote script, see `RemoteScript`. When QUIET_COMMANDS is set, a failing command only
+        causes a warning, like with `run(quiet=True)`.
         """
+        commands = list(env.conf.app_restart_commands)
+        if env.conf.warmup.get('disable_command'):
+            # Take the node out of rotation, the warm-up puts it back once the caches are primed.
+            commands.insert(0, env.conf.warmup['disable_command'] % env[self.cmd_data['dest']])
+
         print('Restarting application...')
-        for cmd in env.conf.app_restart_commands:
-            run(cmd, quiet=env.conf.quiet_commands)
\ No newline at end of file
+        return RemoteScript('restart', commands).execute(warn_only=env.conf.quiet_commands)
\ No newline at end of file
@@ -0,0 +1,115 @@
+"""
+This file contains the fan-out distribution, which copies a folder to a fleet of hosts by turning the hosts that
+already have it into rsync sources for the next ones.
+"""
+# Fabric/Global Imports
+from fabric.api import env, execute, settings, abort
+from fabfile.core.common import run_concurrently, RSYNC_VANISHED_FILES
+from fabfile.core.output import stream_run, stream_local
+
+# Stands for the machine that `fab` is running on, in the transfer plan.
+ORIGIN = 'origin'
+
+
+def plan_round(holders, remaining, degree):
+    """
+    Returns the transfers for the next round, as a list of (source, target) tuples: every host that already has the
+    data (and the origin) sends it to up to `degree` of the `remaining` hosts. Since the number of sources grows by a
+    factor of `degree + 1` every round, the number of rounds grows logarithmically with the number of hosts.
+    :param holders: hosts that have the data, starting with ORIGIN
+    :param remaining: hosts that don't have the data yet
+    :param degree: number of transfers per source & round
+    """
+    remaining = list(remaining)
+    hops = []
+    for source in holders:
+        for _ in range(degree):
+            if not len(remaining):
+                return hops
+            hops.append((source, remaining.pop(0)))
+    return hops
+
+
+def distribute(local_path, remote_path, hosts, degree=None, rsync_options='-az'):
+    """
+    Copies the contents of the `local_path` folder into the `remote_path` folder on all of the `hosts`, in rounds:
+    the first hosts get it from this machine, then they become sources for the next ones, and so on (see
+    `plan_round()`). The transfers within a round run concurrently, and each one's progress & duration is reported.
+    Hosts copy to each other with SSH agent forwarding, so they need to be able to reach each other with the same host
+    strings. A host that fails is reported at the end, and is not used as a source.
+
+    Example usage:
+
+    - distribute('/www/project/wp-content/uploads', '~/webapps/project/wp-content/uploads', env.prod['hosts'])
+    :param local_path: folder on this machine
+    :param remote_path: folder on the hosts (it is created if it doesn't exist)
+    :param hosts: list of host strings
+    :param degree: number of transfers per source & round (default: the FANOUT['degree'] config value)
+    :param rsync_options: options for every rsync call
+    """
+    degree = int(degree or env.conf.fanout.get('degree', 2))
+    relay_ssh = env.conf.fanout.get('relay_ssh', 'ssh -o BatchMode=yes')
+    cmd_vars = dict(options=rsync_options, local_path=local_path.rstrip('/'), remote_path=remote_path.rstrip('/'),
+                    relay_ssh=relay_ssh)
+
+    holders = [ORIGIN]
+    remaining = list(hosts)
+    failed = []
+    round_number = 0
+    while len(remaining):
+        hops = plan_round(holders, remaining, degree)
+        round_number += 1
+        print('Distribution round %d: %d transfers, %d hosts left...' % (round_number, len(hops), len(remaining)))
+
+        branches = []
+        for source, target in hops:
+            remaining.remove(target)
+            branches.append(('%s -> %s' % (source, target), _make_hop(source, target, cmd_vars)))
+
+        for name, _, error in run_concurrently(branches):
+            target = name.split(' -> ')[1]
+            if error:
+                failed.append(target)
+            else:
+                holders.append(target)
+
+    if len(failed):
+        abort('Distribution to %s failed.' % ', '.join(failed))
+
+
+def _make_hop(source, target, cmd_vars):
+    """
+    Returns a callable that copies the data from `source` (ORIGIN or a host) to `target`.
+    """
+    hop_vars = dict(cmd_vars, target=target)
+    # Each hop gets its own log file, since a source runs several of them at the same time.
+    log_name = 'fanout-%s-to-%s' % (source, target)
+    # Creates the destination folder first, since rsync only creates the last folder of the path.
+    rsync = 'rsync %(options)s --rsync-path="mkdir -p %(remote_path)s && rsync"' % hop_vars
+    if source == ORIGIN:
+        cmd = rsync + ' %(local_path)s/ %(target)s:%(remote_path)s' % hop_vars
+
+        def send():
+            return_code, _ = stream_local(cmd, warn_only=True, log_name=log_name)
+            _check_rsync(return_code, target)
+
+        return send
+
+    cmd = rsync + ' -e "%(relay_ssh)s" %(remote_path)s/ %(target)s:%(remote_path)s' % hop_vars
+
+    def relay():
+        with settings(forward_agent=True):
+            result, _ = stream_run(cmd, warn_only=True, log_name=log_name)
+        _check_rsync(result.return_code, target)
+
+    return lambda: execute(relay, hosts=[source])
+
+
+def _check_rsync(return_code, target):
+    """
+    Aborts the hop if rsync failed, files that vanished during the transfer only cause a warning.
+    """
+    if return_code == RSYNC_VANISHED_FILES:
+        print('Warning: some files vanished while copying to %s.' % target)
+    elif return_code != 0:
+        abort('Copying to %s failed.' % target)
@@ -2,8 +2,11 @@
 This file contains the file synchronization task.
 """
 # Fabric/Global Imports
-from fabric.api import env, run, local, cd, lcd, quiet, execute, parallel
+from fabric.api import env, run, local, cd, lcd, quiet, execute, parallel, abort
 from fabric.tasks import Task
+from fabfile.core.common import RSYNC_VANISHED_FILES
+from fabfile.core.fanout import distribute
+from fabfile.core.output import stream_local
 
 
 class FileSync(Task):
@@ -25,6 +28,10 @@ class FileSync(Task):
         folders defined in the UNVERSIONED_FOLDERS config value. Note that this function DOES NOT copy/transfer any of the
         application code - that must be done instead using the "deploy" task.
 
+        When uploading from the local environment with the FANOUT config value set, the folders are copied to all of
+        the destination's hosts, with the hosts that already have them relaying them to the next ones (see
+        `fanout.distribute()`).
+
         Example usage:
 
         - `fab rsync             # Default params, same as following command.`
@@ -42,11 +49,19 @@ class FileSync(Task):
                 'dir': dir,
                 'extra_options': '--cvs-exclude',
             }
-            if src == 'local':
+            if src == 'local' and env.conf.fanout:
+                print('Distributing unversioned files...')
+                distribute('%(root)s/%(dir)s' % cmd_vars, '%(dest_root)s/%(dir)s' % cmd_vars, env[dest]['hosts'],
+                           rsync_options='-raz %(extra_options)s' % cmd_vars)
+                continue
+            elif src == 'local':
                 cmd = 'rsync -ravz %(extra_options)s %(root)s/%(dir)s/ %(dest_host)s:%(dest_root)s/%(dir)s' % cmd_vars
             else:
                 cmd = 'rsync -ravz %(extra_options)s %(src_host)s:%(root)s/%(dir)s/ %(dest_root)s/%(dir)s' % cmd_vars
             print('Syncing unversioned files...')
-            with quiet():
-                local(cmd)
+            return_code, _ = stream_local(cmd, warn_only=True)
+            if return_code == RSYNC_VANISHED_FILES:
+                print('Warning: some files vanished while syncing %s.' % dir)
+            elif return_code != 0:
+                abort('Syncing %s failed.' % dir)
 
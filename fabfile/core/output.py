@@ -0,0 +1,189 @@
+"""
+This file contains the output handling for long-running/noisy commands: instead of capturing the whole output in
+memory, it gets streamed line-by-line to a per-host log file, while only the last lines are kept in memory.
+"""
+# Fabric/Global Imports
+from fabric.api import env, run, settings, hide, show, abort
+from collections import deque
+import io
+import os
+import re
+import subprocess
+import sys
+import time
+
+# Longest line that is buffered while waiting for a newline, anything longer is split.
+MAX_LINE_LENGTH = 64 * 1024
+
+
+class OutputStream(object):
+    """
+    File-like object that receives a command's output (it can be given to `run()` as its `stdout`/`stderr`), and:
+
+    - appends every line to a log file for the current host, or for `log_name` (see the OUTPUT config value)
+    - keeps the last OUTPUT['buffer_lines'] lines in memory, so they can be shown if the command fails
+    - displays the lines on the console, unless QUIET_COMMANDS is set or they match one of the OUTPUT['filters'],
+      and at most OUTPUT['max_lines_per_second'] of them (the number of skipped lines is displayed instead)
+    - collects the lines matching the `keep` regex separately, instead of handling them like the rest of the output
+
+    Memory usage stays the same regardless of how much output the command produces.
+    """
+
+    def __init__(self, cmd, keep=None, log_name=None):
+        conf = env.conf.output
+        self.host = env.host_string or 'localhost'
+        # Commands that run concurrently from the same host need their own log file, or their lines would interleave.
+        self.log_name = log_name or self.host
+        self.tail = deque(maxlen=int(conf.get('buffer_lines', 200)))
+        self.filters = [re.compile(pattern) for pattern in conf.get('filters', [])]
+        self.max_lines_per_second = int(conf.get('max_lines_per_second', 20))
+        self.keep = re.compile(keep) if keep else None
+        self.kept = []
+        self.partial = u''
+        self.window_start = time.time()
+        self.window_lines = 0
+        self.suppressed = 0
+
+        self.log_fn = self.get_log_fn()
+        self.log = io.open(self.log_fn, 'a', encoding='utf-8')
+        # Keep the database passwords (`-pPASSWORD`) out of the log file.
+        self.log.write(u'=== %s %s\n' % (time.strftime('%Y.%m.%d-%H.%M.%S'), re.sub(r'(\s-p)\S+', r'\1****', cmd)))
+
+
+    def get_log_fn(self):
+        """
+        Returns the path of the log file, creating the log folder if needed. The folder defaults to
+        `logs/` inside of the local environment's archive folder.
+        """
+        log_dir = env.conf.output.get('log_dir') or os.path.join(env['local']['archive'], 'logs')
+        log_dir = os.path.expanduser(log_dir)
+        if not os.path.isdir(log_dir):
+            os.makedirs(log_dir)
+        return os.path.join(log_dir, '%s.log' % re.sub(r'[^\w.@-]', '_', self.log_name))
+
+
+    def write(self, data):
+        if isinstance(data, bytes):
+            data = data.decode('utf-8', 'replace')
+        lines = (self.partial + data).split(u'\n')
+        self.partial = lines.pop()
+        if len(self.partial) > MAX_LINE_LENGTH:
+            lines.append(self.partial)
+            self.partial = u''
+        for line in lines:
+            self.write_line(line.rstrip(u'\r'))
+
+
+    def write_line(self, line):
+        if self.keep and self.keep.search(line):
+            self.kept.append(line)
+            return
+
+        self.log.write(line + u'\n')
+        self.tail.append(line)
+        if env.conf.quiet_commands or any([f.search(line) for f in self.filters]):
+            return
+
+        now = time.time()
+        if now - self.window_start >= 1:
+            self.print_suppressed()
+            self.window_start = now
+            self.window_lines = 0
+        if self.window_lines < self.max_lines_per_second:
+            print_line(u'[%s] %s' % (self.host, line))
+            self.window_lines += 1
+        else:
+            self.suppressed += 1
+
+
+    def print_suppressed(self):
+        if self.suppressed:
+            print('[%s] ... %d more lines (see %s)' % (self.host, self.suppressed, self.log_fn))
+            self.suppressed = 0
+
+
+    def flush(self):
+        self.log.flush()
+
+
+    def close(self):
+        if self.partial:
+            self.write_line(self.partial.rstrip(u'\r'))
+            self.partial = u''
+        self.print_suppressed()
+        self.log.close()
+
+
+    def report_failure(self, message):
+        """
+        Prints the last lines of output along with `message`, for when the command has failed.
+        """
+        print('%s Last %d lines of output (full output in %s):' % (message, len(self.tail), self.log_fn))
+        for line in self.tail:
+            print_line(u'[%s] %s' % (self.host, line))
+
+
+def print_line(line):
+    """
+    Prints a line of command output. On Python 2, printing unicode fails with a UnicodeEncodeError when stdout isn't
+    a UTF-8 terminal (e.g. when piped into `tee`, or under cron), so the line is encoded first.
+    """
+    if sys.version_info[0] < 3:
+        line = line.encode('utf-8', 'replace')
+    print(line)
+
+
+def stream_run(cmd, keep=None, warn_only=False, log_name=None):
+    """
+    Executes `cmd` on the current host, like `run()`, except that the output is handled by an `OutputStream`
+    (so it is logged, and only the last lines are kept in memory). If the command fails, the last lines of output
+    are displayed, and the task is aborted unless `warn_only` is set. Returns a (result, stream) tuple; the result's
+    return code/`failed` can be checked as usual, but it does not contain the whole output. The output is logged to
+    the current host's log file, unless a different `log_name` is given.
+
+    Example usage:
+
+    - stream_run('mysql ... < dump.sql')
+    """
+    stream = OutputStream(cmd, keep=keep, log_name=log_name)
+    visibility = hide('running', 'warnings') if env.conf.quiet_commands else hide('warnings')
+    try:
+        # `stdout` has to be "shown", otherwise Fabric doesn't write anything to the stream at all.
+        with settings(visibility, show('stdout', 'stderr'), output_prefix=False, warn_only=True):
+            result = run(cmd, stdout=stream, stderr=stream, capture_buffer_size=MAX_LINE_LENGTH)
+    finally:
+        stream.close()
+
+    if result.failed:
+        stream.report_failure('Command failed on %s with exit code %s.' % (stream.host, result.return_code))
+        if not warn_only:
+            abort('Command failed on %s: %s' % (stream.host, cmd))
+    return result, stream
+
+
+def stream_local(cmd, keep=None, warn_only=False, log_name=None):
+    """
+    Executes `cmd` locally (in the `lcd()` folder, if any), like `local()`, with the output handled the same way as
+    in `stream_run()`. Returns a (return_code, stream) tuple.
+
+    Example usage:
+
+    - stream_local('rsync -ravz user@server:/path/ /path')
+    """
+    if not env.conf.quiet_commands:
+        print('[localhost] local: %s' % cmd)
+    stream = OutputStream(cmd, keep=keep, log_name=log_name)
+    try:
+        process = subprocess.Popen(cmd, shell=True, stdout=subprocess.PIPE, stderr=subprocess.STDOUT,
+                                   cwd=os.path.expanduser(env.lcwd) if env.lcwd else None)
+        for line in iter(process.stdout.readline, b''):
+            stream.write(line)
+        return_code = process.wait()
+    finally:
+        stream.close()
+
+    if return_code != 0:
+        stream.report_failure('Local command failed with exit code %s.' % return_code)
+        if not warn_only:
+            abort('Local command failed: %s' % cmd)
+    return return_code, stream
@@ -0,0 +1,123 @@
+"""
+This file contains the remote script executor, which runs a whole list of commands on a host with a single `run()`.
+"""
+# Fabric/Global Imports
+from fabric.api import env, put, abort
+from fabfile.core.output import stream_run
+import base64
+import re
+import uuid
+
+try:
+    from StringIO import StringIO
+except ImportError:
+    from io import StringIO
+
+# Prefix of the status lines that the script prints after each command.
+MARKER = '__FAB_STEP__'
+
+# Scripts up to this size (base64-encoded) are sent as part of the command itself, bigger ones get uploaded first.
+MAX_INLINE_SIZE = 64 * 1024
+
+
+class RemoteScript(object):
+    """
+    Renders a list of shell commands into one bash script, which gets sent to the current host and executed with
+    a single `run()` call, instead of paying for a separate remote shell & round trip per command. Each command runs
+    in its own subshell (so a `cd` in one command doesn't affect the next one), from the directory that `run()` would
+    have used. The script stops at the first command that fails, unless it is executed with `warn_only`.
+
+    Example usage:
+
+    - `steps = RemoteScript('post-deploy', ['chmod 755 .', 'rm -f Gruntfile.js']).execute()`
+    """
+
+    def __init__(self, name, commands=None):
+        self.name = name
+        self.commands = list(commands or [])
+
+
+    def render(self, warn_only=False):
+        """
+        Returns the source of the script. After each command, a status line is printed with the command's index,
+        exit code, and start & end times.
+        :param warn_only: keep going after a command fails, instead of exiting with its exit code
+        """
+        lines = [
+            '#!/bin/bash',
+            '# %s' % self.name,
+            '_fab_now() { if [ -n "$EPOCHREALTIME" ]; then echo "$EPOCHREALTIME"; else date +%s; fi; }',
+        ]
+        for index, cmd in enumerate(self.commands):
+            lines.extend([
+                '_fab_start=$(_fab_now)',
+                '(',
+                cmd,
+                ')',
+                '_fab_rc=$?',
+                # Starts on a new line, in case the command's output didn't end with one.
+                'printf \'\\n%s %d %%s %%s %%s\\n\' $_fab_rc $_fab_start $(_fab_now)' % (MARKER, index),
+            ])
+            if not warn_only:
+                lines.append('[ $_fab_rc -eq 0 ] || exit $_fab_rc')
+        return '\n'.join(lines) + '\n'
+
+
+    def execute(self, warn_only=False):
+        """
+        Sends & executes the script on the current host, and returns a list of dicts (one per command) with the
+        `command`, its `exit_code` and its `duration` in seconds. Commands that were never reached, because an earlier
+        one failed, have None for both. Unless `warn_only` is set, a failing command aborts the task; with it, the
+        remaining commands are still executed, and the failures are only reported.
+        :param warn_only: report failing commands instead of aborting
+        """
+        if not len(self.commands):
+            return []
+
+        script = base64.b64encode(self.render(warn_only).encode('utf-8')).decode('ascii')
+        if len(script) <= MAX_INLINE_SIZE:
+            # The script is written to a file (rather than piped into bash), so that commands reading stdin don't
+            # consume it. base64 keeps it safe from any shell quoting.
+            cmd = ('_fab_script=$(mktemp) && echo %s | base64 -d > $_fab_script && bash $_fab_script; '
+                   '_fab_rc=$?; rm -f $_fab_script; exit $_fab_rc' % script)
+        else:
+            script_fn = '/tmp/fab-%s.sh' % uuid.uuid4().hex
+            put(StringIO(self.render(warn_only)), script_fn)
+            cmd = 'bash %s; _fab_rc=$?; rm -f %s; exit $_fab_rc' % (script_fn, script_fn)
+        # The blank lines that the status lines start with are dropped as well.
+        result, stream = stream_run(cmd, keep='^(%s |$)' % MARKER, warn_only=True)
+
+        steps = [dict(command=cmd, exit_code=None, duration=None) for cmd in self.commands]
+        for line in stream.kept:
+            match = re.match(r'^%s (\d+) (\d+) (\S+) (\S+)$' % MARKER, line.strip())
+            if match:
+                # Some locales print EPOCHREALTIME with a comma as the decimal separator.
+                start, end = [float(t.replace(',', '.')) for t in match.group(3, 4)]
+                steps[int(match.group(1))].update(exit_code=int(match.group(2)), duration=end - start)
+
+        failed = [step for step in steps if step['exit_code']]
+        if result.failed and not warn_only:
+            if len(failed):
+                abort('The %s script failed on %s, `%s` exited with code %d.' %
+                      (self.name, env.host_string, failed[0]['command'], failed[0]['exit_code']))
+            abort('The %s script could not be executed on %s (exit code %d).' %
+                  (self.name, env.host_string, result.return_code))
+        for step in failed:
+            print('Warning: `%s` exited with code %d on %s.' % (step['command'], step['exit_code'], env.host_string))
+
+        self.report(steps)
+        return steps
+
+
+    def report(self, steps):
+        """
+        Prints the timings of the executed commands. When the QUIET_COMMANDS config value is set, this only prints
+        a single summary line.
+        :param steps: list of dicts, as returned by `execute()`
+        """
+        executed = [step for step in steps if step['duration'] is not None]
+        total = sum([step['duration'] for step in executed])
+        print('%s: %s finished %d/%d commands in %.2fs.' % (env.host_string, self.name, len(executed), len(steps), total))
+        if not env.conf.quiet_commands:
+            for step in executed:
+                print('  %7.2fs  exit %d  %s' % (step['duration'], step['exit_code'], step['command']))
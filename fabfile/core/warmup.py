@@ -0,0 +1,192 @@
+"""
+This file contains the cache warm-up task.
+"""
+# Fabric/Global Imports
+from fabric.api import env, run, put, execute, parallel, roles, abort
+from fabric.tasks import Task
+from xml.sax.saxutils import unescape
+import math
+import re
+
+try:
+    from StringIO import StringIO
+    from urlparse import urljoin, urlparse
+except ImportError:
+    from io import StringIO
+    from urllib.parse import urljoin, urlparse
+
+
+class Warmup(Task):
+    """
+    Primes the caches on each node by requesting a list of URLs from it directly. (dest: prod)
+    """
+    name = 'warmup'
+    cmd_data = dict(dest=None)
+
+    def __init__(self, *args, **kwargs):
+        super(Warmup, self).__init__(*args, **kwargs)
+
+
+    def run(self, dest='prod', *args, **kwargs):
+        """
+        Primes the caches on each node by requesting a list of URLs from it directly. (dest: prod)
+
+        This is executed automatically after the application has been restarted (by the "deploy" and "restart" tasks),
+        so that the first visitors after a deploy don't have to wait for the opcode & page caches to fill up. The URLs
+        are built from the WARMUP config value (a static list, the sitemap, and/or the most requested paths from an
+        access log), and are requested on each node against its own web server, bypassing the load balancer. Every
+        URL is requested twice, and the latency percentiles of both passes are reported.
+
+        If WARMUP['enable_command'] is set, it is executed once the warm-up has succeeded, which can be used to put the
+        node back into the load balancer's rotation.
+
+        Example usage:
+
+        - `fab warmup        # Warms up the caches on all of the production nodes.`
+        - `fab warmup:dev    # Warms up the caches on the dev nodes.`
+        """
+        self.cmd_data = dict(dest=dest)
+        return execute(self.warm, role=dest)
+
+
+    @parallel
+    @roles('prod')
+    def warm(self):
+        """
+        Requests the warm-up URLs from the current node, and reports the latencies before & after warming.
+        """
+        dest = self.cmd_data['dest']
+        conf = env.conf.warmup
+        urls = self.get_urls(dest)
+        if not len(urls):
+            # Never put the node back into rotation without having warmed it up (e.g. when the sitemap couldn't be
+            # fetched because PHP was still starting up).
+            abort('Warm-up failed on %s, there were no URLs to warm up.' % env.host_string)
+
+        print('Warming up %d URLs on %s...' % (len(urls), env.host_string))
+        cold = self.fetch_urls(urls)
+        warm = self.fetch_urls(urls)
+        print('%s cold: %s' % (env.host_string, self.format_latencies(cold)))
+        print('%s warm: %s' % (env.host_string, self.format_latencies(warm)))
+
+        # URLs without a result (e.g. when curl isn't installed) count as errors too.
+        errors = [url for url, status, _ in warm if status == 0 or status >= 500]
+        error_count = len(errors) + max(0, len(urls) - len(warm))
+        if error_count > conf.get('max_error_rate', 0.1) * len(urls):
+            abort('Warm-up failed on %s, %d of %d URLs returned errors or no result%s.' %
+                  (env.host_string, error_count, len(urls), ' (e.g. %s)' % errors[0] if errors else ''))
+
+        if conf.get('enable_command'):
+            run(conf['enable_command'] % env[dest], quiet=env.conf.quiet_commands)
+
+        return dict(cold=cold, warm=warm)
+
+
+    def get_urls(self, dest):
+        """
+        Builds the list of URLs to warm up from the WARMUP config value. Paths are relative to the environment's
+        `home_url`. Duplicates are removed, and the order is preserved.
+        :param dest: destination server (local, prod, dev)
+        """
+        conf = env.conf.warmup
+        base = env[dest]['home_url']
+        paths = list(conf.get('urls', []))
+
+        if conf.get('sitemap'):
+            sitemap_urls = self.fetch_sitemap(urljoin(base, conf['sitemap']))
+            # Sitemap indexes (like the ones from Yoast) just link to other sitemaps, so follow those one level down.
+            for url in list(sitemap_urls):
+                if url.endswith('.xml'):
+                    sitemap_urls.remove(url)
+                    sitemap_urls.extend(self.fetch_sitemap(url))
+            paths.extend(sitemap_urls)
+
+        if conf.get('access_log'):
+            # The method field is `"GET` (with the opening quote of the request line). Fabric's shell wrapping
+            # doesn't escape backslashes, so it's matched without one. `sed` reads all of its input (unlike `head`),
+            # so `sort` never gets a SIGPIPE that `pipefail` would report as a failure.
+            cmd = ('set -o pipefail; awk \'$6 ~ /^.GET$/ && $9 == 200 {print $7}\' %s | sort | uniq -c | sort -rn | '
+                   'sed -n 1,%dp' % (conf['access_log'], int(conf.get('top_n', 50))))
+            output = run(cmd, quiet=True)
+            if output.failed:
+                abort('Reading the access log %s failed on %s.' % (conf['access_log'], env.host_string))
+            paths.extend([line.split()[-1] for line in output.splitlines() if line.strip()])
+
+        urls = []
+        for path in paths:
+            url = urljoin(base, path)
+            # These would break the `xargs` call in `fetch_urls()`.
+            if url not in urls and not re.search(r'[\s\'"]', url):
+                urls.append(url)
+        return urls
+
+
+    def fetch_sitemap(self, url):
+        """
+        Fetches a sitemap from the current node, and returns the URLs it lists.
+        :param url: full URL of the sitemap
+        """
+        output = run('curl -s -k --max-time %d %s %s' % (self.get_timeout(), self.make_resolve_opts([url]), url),
+                     quiet=True)
+        return [unescape(url, {'&quot;': '"', '&apos;': "'"})
+                for url in re.findall(r'<loc>\s*(.*?)\s*</loc>', output)]
+
+
+    def fetch_urls(self, urls):
+        """
+        Requests the `urls` from the current node, up to WARMUP['concurrency'] at a time, and returns a list of
+        (url, status, seconds) tuples. A status of 0 means that the request failed, or timed out.
+        :param urls: list of full URLs
+        """
+        conf = env.conf.warmup
+        url_list_fn = run('mktemp', quiet=True).strip()
+        put(StringIO('\n'.join(urls) + '\n'), url_list_fn)
+        cmd = ("xargs -P %d -n 1 curl -s -k -o /dev/null --max-time %d %s -w '%%{http_code} %%{time_total} "
+               "%%{url_effective}\\n' < %s; rm -f %s" % (int(conf.get('concurrency', 8)), self.get_timeout(),
+                                                          self.make_resolve_opts(urls), url_list_fn, url_list_fn))
+        output = run(cmd, quiet=True)
+
+        results = []
+        for line in output.splitlines():
+            parts = line.split()
+            if len(parts) == 3:
+                results.append((parts[2], int(parts[0]), float(parts[1])))
+        return results
+
+
+    def make_resolve_opts(self, urls):
+        """
+        Returns the curl options that make every hostname in `urls` resolve to the node's own web server (the
+        WARMUP['address'] value), so the requests bypass DNS & the load balancer, while keeping the right `Host`
+        header & TLS server name.
+        :param urls: list of full URLs
+        """
+        address = env.conf.warmup.get('address', '127.0.0.1')
+        opts = []
+        for url in urls:
+            parsed = urlparse(url)
+            port = parsed.port or (443 if parsed.scheme == 'https' else 80)
+            opt = '--resolve %s:%d:%s' % (parsed.hostname, port, address)
+            if opt not in opts:
+                opts.append(opt)
+        return ' '.join(opts)
+
+
+    def get_timeout(self):
+        return int(env.conf.warmup.get('timeout', 30))
+
+
+    def format_latencies(self, results):
+        """
+        Formats the p50/p90/p99/max latencies (in milliseconds) of the successful requests in `results`.
+        :param results: list of (url, status, seconds) tuples, as returned by `fetch_urls()`
+        """
+        times = sorted([seconds for _, status, seconds in results if 0 < status < 500])
+        if not len(times):
+            return 'no successful requests'
+
+        def percentile(p):
+            return times[max(0, int(math.ceil(p / 100.0 * len(times))) - 1)] * 1000
+
+        return 'p50=%dms p90=%dms p99=%dms max=%dms (%d/%d ok)' % (
+            percentile(50), percentile(90), percentile(99), times[-1] * 1000, len(times), len(results))